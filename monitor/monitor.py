@@ -4,9 +4,16 @@ import datetime
 import logging
 import os
 import csv
-from collections import defaultdict
+import queue
+import threading
+import json
+from collections import defaultdict, deque
 import sys # Needed for sys.executable, sys.exit, and sys.argv
-import ctypes # Needed for Windows API calls (IsUserAnAdmin, ShellExecuteW)
+# ctypes (Windows API calls IsUserAnAdmin, ShellExecuteW) is imported lazily in the Windows-only admin helpers
+try:
+    import orjson # Optional: faster serialization for the NDJSON system summary; the json module is used without it
+except ImportError:
+    orjson = None
 
 # --- تنظیمات ---
 # Determine the script's or executable's directory
@@ -18,14 +25,51 @@ else:
     # Running as a normal Python script
     script_directory = os.path.dirname(os.path.abspath(__file__))
 
-# Define file paths relative to the script/executable directory
-LOG_FILENAME = os.path.join(script_directory, 'script_operational_log.txt')
-SNAPSHOT_FILENAME_TXT = os.path.join(script_directory, "task_manager_snapshot.txt")
-SYSTEM_SUMMARY_FILENAME = os.path.join(script_directory, "system_summary.csv") # Name is defined, but writing is conditional
+# Define file paths relative to the script/executable directory (computed once, as plain strings)
+_SEP = os.sep
+LOG_FILENAME = f"{script_directory}{_SEP}script_operational_log.txt"
+SNAPSHOT_FILENAME_TXT = f"{script_directory}{_SEP}task_manager_snapshot.txt"
+SYSTEM_SUMMARY_FILENAME = f"{script_directory}{_SEP}system_summary.csv" # Name is defined, but writing is conditional
+SYSTEM_SUMMARY_FILENAME_NDJSON = f"{script_directory}{_SEP}system_summary.ndjson" # Same, for the NDJSON summary
 INDENT_STRING = "  "
 
+def _make_line_layout(depth):
+    """Returns (name field width, line formatter) for a tree depth. The Name column (45 wide at the root)
+       shrinks by the indent width down to a minimum of 1; the formatter already starts with the indent and
+       takes (name, pid, status, cpu, mem, disk, net) positionally.
+    """
+    name_width = max(1, 45 - len(INDENT_STRING) * depth)
+    template = f"{INDENT_STRING * depth}{{:<{name_width}}}{{:<8}}{{:<15}}{{:<8}}{{:<12}}{{:<18}}{{:<10}}\n"
+    return name_width, template.format
+
+# Precomputed snapshot line layouts for the usual tree depths; deeper levels are built on demand
+_LINE_LAYOUTS = [_make_line_layout(depth) for depth in range(64)]
+# Line for a root process that is gone (name, PID, status, then '-' for every resource column), same widths as the root template
+_DISAPPEARED_FMT = "{:<45}{:<8}{:<15}{:<8}{:<12}{:<18}{:<10}\n".format
+
 # --- تنظیمات جدید ---
 ENABLE_SYSTEM_SUMMARY_CSV = False # <<< Set to True if you want the system_summary.csv file
+ENABLE_SYSTEM_SUMMARY_NDJSON = False # <<< Set to True for system_summary.ndjson (one JSON object per line, raw numbers)
+SYSTEM_SUMMARY_QUEUE_SIZE = 16 # Rows waiting for each background summary writer; newer rows are dropped when full
+SYSTEM_SUMMARY_FLUSH_EVERY = 10 # The summary writers flush their file every N rows (and when monitoring stops)
+SNAPSHOT_WRITE_QUEUE_SIZE = 16 # Snapshots waiting for the background snapshot writer; the monitor waits when full
+
+# Process attributes fetched in one process_iter() call on the psutil path (io_counters does not exist on macOS)
+PSUTIL_PROCESS_ATTRS = ['pid', 'ppid', 'name', 'status', 'create_time', 'cpu_times', 'memory_info'] + \
+                       (['io_counters'] if hasattr(psutil.Process, 'io_counters') else [])
+
+# --- Linux /proc fast path ---
+# On Linux, per-process data is parsed directly from /proc/<pid>/stat and /proc/<pid>/io
+# instead of going through psutil.Process objects. psutil is kept as the fallback for Windows/macOS.
+USE_PROCFS_FAST_PATH = sys.platform.startswith('linux') and os.path.isdir('/proc')
+if USE_PROCFS_FAST_PATH:
+    _CLK_TCK = os.sysconf('SC_CLK_TCK') # Clock ticks per second used by utime/stime in /proc/<pid>/stat
+    _PAGE_SIZE_KB = os.sysconf('SC_PAGE_SIZE') // 1024 # rss in /proc/<pid>/stat is given in pages
+_PROC_READ_SIZE = 4096 # stat/io/cmdline are read with a single read() of this size
+# Mapping of the single-letter state in /proc/<pid>/stat to the status names psutil reports
+_PROC_STATUSES = {b'R': 'running', b'S': 'sleeping', b'D': 'disk-sleep', b'T': 'stopped',
+                  b't': 'tracing-stop', b'Z': 'zombie', b'X': 'dead', b'x': 'dead',
+                  b'K': 'wake-kill', b'W': 'waking', b'I': 'idle', b'P': 'parked'}
 
 # --- تنظیم لاگر ---
 # Configure logger only if it hasn't been configured before (prevents duplicate handlers if relaunched)
@@ -41,37 +85,59 @@ if not logging.getLogger().handlers:
          pass # Ignore if logger name 'psutil' is not yet registered
 
 
+# --- فایل Snapshot ---
+# The snapshot text file is opened as a raw descriptor in append mode when monitoring starts and kept open
+# until it stops. Each snapshot is UTF-8 encoded and written in one piece by a background thread.
+_snap_fd = None # Descriptor of SNAPSHOT_FILENAME_TXT while monitoring runs, None otherwise
+
+def _open_snapshot_file():
+    """Opens the snapshot text file as a raw descriptor in append mode, creating it if needed."""
+    return os.open(SNAPSHOT_FILENAME_TXT, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+
+
 # --- متغیرهای سراسری (برای نگهداری وضعیت بین Snapshot ها) ---
-previous_io_counters = {} # Stores psutil.Process.io_counters() from the PREVIOUS snapshot
-process_objects_cache = {} # Stores psutil.Process objects for reuse
+# The previous-snapshot caches are replaced wholesale every snapshot, so PIDs that ended never linger in them.
+# Each entry is also tied to the process start time, so a PID reused by a new process never inherits the old counters.
+previous_io_counters = {} # psutil path: {(pid, create_time): psutil.Process.io_counters()} from the PREVIOUS snapshot
+previous_cpu_times = {} # psutil path: {(pid, create_time): user+system CPU seconds} from the PREVIOUS snapshot
+previous_proc_counters = {} # Linux /proc path: {pid: (prev_cpu_ticks, prev_read_bytes, prev_write_bytes, starttime)} from the PREVIOUS snapshot
 current_snapshot_data = {} # Stores processed data (CPU%, Mem, IO Delta) for the CURRENT snapshot
 
 
 # --- توابع کمکی ---
+_INV_KB = 1.0 / 1024 # Reciprocals of 1 KB / 1 MB, for converting by multiplication
+_INV_MB = 1.0 / (1024 * 1024)
+_fmt2 = "{:.2f}".format # Bound formatter for the two-decimal values of the system summary CSV
+
+# Logical CPU core count, detected once at import; per-process CPU is scaled by its reciprocal
+_CPU_CORES = max(1, os.cpu_count() or 1)
+_INV_CPU_CORES = 1.0 / _CPU_CORES
+
 def get_cpu_cores():
     """تعداد هسته‌های منطقی CPU را برمی‌گرداند"""
-    try:
-        count = psutil.cpu_count(logical=True)
-        if count is None or count == 0:
-            logging.warning("Could not detect CPU core count, defaulting to 1.")
-            return 1
-        return count
-    except Exception as e:
-        logging.error(f"Error getting CPU count: {e}")
-        return 1 # fallback
+    return _CPU_CORES
 
 def format_bytes_to_mb(byte_val):
     """بایت را به مگابایت تبدیل می‌کند"""
-    return byte_val / (1024 * 1024)
+    return byte_val * _INV_MB
 
 def format_rate_mbps(bytes_per_second):
     """بایت بر ثانیه را به مگابایت بر ثانیه فرمت می کند (MB/s)"""
-    mb_per_second = format_bytes_to_mb(bytes_per_second)
+    if bytes_per_second == 0:
+        return "0.0 MB/s" # Most processes have no disk activity in an interval
+    mb_per_second = bytes_per_second * _INV_MB
     if abs(mb_per_second) < 0.01:
         return "0.0 MB/s"
     else:
         return f"{mb_per_second:.1f} MB/s"
 
+def format_mb_display(kb):
+    """حافظه بر حسب کیلوبایت را برای نمایش به مگابایت فرمت می‌کند"""
+    if kb == 0:
+        return "0.0 MB"
+    mb = kb * _INV_KB
+    return f"{mb:,.1f} MB" if mb >= 0.1 else "< 0.1 MB"
+
 def is_script_really_admin():
     """Checks if the current script process is running with elevated privileges using Windows API (on Windows).
        Checks for UID == 0 on POSIX systems.
@@ -79,6 +145,7 @@ def is_script_really_admin():
     if os.name == 'nt':
         try:
             # Use ctypes to call Windows API function IsUserAnAdmin
+            import ctypes
             return ctypes.windll.shell32.IsUserAnAdmin() != 0
         except Exception:
             # Fallback check for Windows, might not be as reliable
@@ -107,6 +174,7 @@ def run_as_admin():
         return False
 
     try:
+        import ctypes # Only needed (and only loaded) for the Windows elevation path
         script_path = os.path.abspath(sys.argv[0]) # Use sys.argv[0] for the path of the script/executable
         # Use ShellExecuteW to run the script again with the "runas" verb
         # Parameter 1: hWnd (handle to owner window, None here)
@@ -135,117 +203,433 @@ def run_as_admin():
         return False
 
 
-# --- تابع بازگشتی لاگ درخت فرآیندی ---
+# --- جمع‌آوری داده‌های فرآیندها ---
+# هر دو تابع زیر current_snapshot_data را برای Snapshot فعلی پر می‌کنند
+def _read_proc_file(path, proc_fd):
+    """Reads a small /proc file relative to the already opened /proc directory descriptor,
+       with one openat(), a single read() and close().
+    """
+    fd = os.open(path, os.O_RDONLY, dir_fd=proc_fd)
+    try:
+        return os.read(fd, _PROC_READ_SIZE)
+    finally:
+        os.close(fd)
+
+
+def _read_full_process_name(entry, comm, proc_fd):
+    """The kernel truncates comm to 15 characters; like psutil, recover the full name from cmdline if possible."""
+    try:
+        cmdline = _read_proc_file(f"{entry}/cmdline", proc_fd)
+    except OSError:
+        return comm
+    if cmdline:
+        extended_name = os.path.basename(cmdline.split(b'\0', 1)[0].decode('utf-8', 'replace'))
+        if extended_name.startswith(comm):
+            return extended_name
+    return comm
+
+
+def _collect_linux_fast(interval_duration, target_name_lower, target_pids, procfs='/proc'):
+    """Collects per-process data on Linux by parsing /proc/<pid>/stat and /proc/<pid>/io directly.
+       Each file is opened and read once; CPU% and I/O deltas are computed against previous_proc_counters.
+       PIDs whose lowercased name equals target_name_lower (if given) are added to target_pids.
+    """
+    global previous_proc_counters, current_snapshot_data
+
+    current_counters = {} # Counters for THIS snapshot, become previous_proc_counters for the next one
+    # Converts a delta of clock ticks into the process CPU percentage over the interval,
+    # already scaled by the number of cores exactly like the psutil path below
+    ticks_to_percent = 100.0 * _INV_CPU_CORES / (_CLK_TCK * interval_duration) if interval_duration > 0 else 0.0
+
+    # Open /proc once per snapshot; every per-PID file is then opened relative to it (openat)
+    proc_fd = os.open(procfs, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        _collect_linux_entries(proc_fd, ticks_to_percent, current_counters, target_name_lower, target_pids)
+    finally:
+        os.close(proc_fd)
+
+    # Replacing the dict also drops counters of processes that ended since the previous snapshot
+    previous_proc_counters = current_counters
+
+
+def _collect_linux_entries(proc_fd, ticks_to_percent, current_counters, target_name_lower, target_pids):
+    """Parses stat/io of every PID directory under the /proc descriptor into current_snapshot_data."""
+    global current_snapshot_data
+
+    for entry in os.listdir(proc_fd):
+        if not entry.isdigit(): continue
+        pid = int(entry)
+
+        try:
+            stat_data = _read_proc_file(f"{entry}/stat", proc_fd)
+        except OSError:
+            continue # Process terminated between listdir() and open()
+
+        # The name (comm) may contain spaces and parentheses, so split on the LAST ')'
+        name_end = stat_data.rfind(b')')
+        name = stat_data[stat_data.find(b'(') + 1:name_end].decode('utf-8', 'replace')
+        if len(name) >= 15:
+            name = _read_full_process_name(entry, name, proc_fd)
+        # Fields after the name, starting at field 3 (state) of proc(5)
+        fields = stat_data[name_end + 2:].split()
+        status = _PROC_STATUSES.get(fields[0], 'N/A')
+        ppid = int(fields[1])
+        cpu_ticks = int(fields[11]) + int(fields[12]) # utime + stime
+        mem_ws_kb = int(fields[21]) * _PAGE_SIZE_KB # rss (pages) -> KB
+        starttime = fields[19] # Start time since boot (kept as raw bytes, only compared) tells a reused PID apart
+
+        # Disk I/O counters; usually requires root (or same user) access
+        read_bytes = write_bytes = None
+        try:
+            io_fields = _read_proc_file(f"{entry}/io", proc_fd).split()
+            # Layout: rchar, wchar, syscr, syscw, read_bytes, write_bytes, ... as "key: value" pairs
+            read_bytes = int(io_fields[9])
+            write_bytes = int(io_fields[11])
+        except (OSError, IndexError, ValueError) as e:
+            status = 'io error'
+            logging.debug("Error fetching IO for P%s: %s", pid, e, exc_info=False)
+
+        # CPU usage and I/O delta since the previous snapshot (0 if this PID is seen for the first time)
+        cpu_val_per_core = 0.0
+        read_delta = 0
+        write_delta = 0
+        prev = previous_proc_counters.get(pid)
+        if prev is not None and prev[3] == starttime:
+            delta_ticks = cpu_ticks - prev[0]
+            if delta_ticks > 0:
+                # Cap the percentage at 100% per process, like the psutil path below
+                cpu_val_per_core = delta_ticks * ticks_to_percent
+                cpu_val_per_core = 100.0 if cpu_val_per_core > 100.0 else cpu_val_per_core
+            if read_bytes is not None and prev[1] is not None:
+                # Counters only grow; clamp at 0
+                read_delta = read_bytes - prev[1]
+                if read_delta < 0: read_delta = 0
+                write_delta = write_bytes - prev[2]
+                if write_delta < 0: write_delta = 0
+        current_counters[pid] = (cpu_ticks, read_bytes, write_bytes, starttime)
+
+        name = name or 'N/A'
+        # Identify processes matching the target application name (case-insensitive)
+        if target_name_lower and name.lower() == target_name_lower:
+            target_pids.add(pid)
+
+        current_snapshot_data[pid] = {
+            'pid': pid,
+            'ppid': ppid,
+            'name': name,
+            'status': status,
+            'cpu_percent': cpu_val_per_core,
+            'mem_ws_kb': mem_ws_kb,
+            'delta_read_bytes': read_delta,
+            'delta_write_bytes': write_delta,
+        }
+
+
+def _collect_psutil(interval_duration, target_name_lower, target_pids):
+    """Collects per-process data through psutil (fallback for Windows/macOS).
+       Everything is fetched by a single process_iter() call with all needed attrs.
+       CPU% is computed from the user+system CPU time delta against previous_cpu_times.
+       PIDs whose lowercased name equals target_name_lower (if given) are added to target_pids.
+    """
+    global previous_io_counters, previous_cpu_times, current_snapshot_data
+
+    current_io_snapshot = {} # Temporary dict to store I/O counters for THIS snapshot
+    current_cpu_times = {} # Temporary dict to store CPU times for THIS snapshot
+    # Converts a delta of CPU seconds into the process CPU percentage over the interval, scaled by the number of cores
+    seconds_to_percent = 100.0 * _INV_CPU_CORES / interval_duration if interval_duration > 0 else 0.0
+
+    # Fetch all info for every process in one pass; attributes that cannot be read
+    # (e.g. access denied) come back as None instead of raising. process_iter(attrs) fills
+    # proc.info via Process.as_dict(), which already runs inside Process.oneshot(), so the
+    # attributes of one process share a single round of system calls.
+    for proc in psutil.process_iter(PSUTIL_PROCESS_ATTRS, ad_value=None):
+        info = proc.info
+        pid = info['pid']
+
+        ppid = info.get('ppid')
+        name = info.get('name') or 'N/A'
+        status = info.get('status') or 'N/A'
+        # Counters are keyed by PID and creation time, so a reused PID starts from zero like a new process
+        counter_key = (pid, info.get('create_time'))
+        # Identify processes matching the target application name (case-insensitive)
+        if target_name_lower and name.lower() == target_name_lower:
+            target_pids.add(pid)
+
+        # CPU usage since the previous snapshot (0 if this PID is seen for the first time)
+        cpu_val_per_core = 0.0
+        cpu_times = info.get('cpu_times')
+        if cpu_times is None:
+            status = 'cpu error'
+        else:
+            cpu_time = cpu_times.user + cpu_times.system
+            current_cpu_times[counter_key] = cpu_time
+            delta_cpu_time = cpu_time - previous_cpu_times.get(counter_key, cpu_time)
+            if delta_cpu_time > 0:
+                # Cap the percentage at 100% per process, mimicking Task Manager's process list view
+                cpu_val_per_core = delta_cpu_time * seconds_to_percent
+                cpu_val_per_core = 100.0 if cpu_val_per_core > 100.0 else cpu_val_per_core
+
+        # Memory usage (Resident Set Size in KB)
+        mem_ws_kb = 0
+        mem_info = info.get('memory_info')
+        if mem_info is None:
+            if status != 'cpu error': status = 'mem error'
+        else:
+            mem_ws_kb = mem_info.rss // 1024 # Resident Set Size is often used as a proxy for Working Set
+
+        # Disk I/O Delta (bytes read/written during the *last* interval)
+        read_delta = 0
+        write_delta = 0
+        current_io = info.get('io_counters')
+        if current_io is None:
+            # Not readable, or not supported on this platform (io_counters is missing on macOS)
+            if status not in ['cpu error', 'mem error']: status = 'io error'
+        else:
+            # Store the current I/O counters for this PID, to be used in the *next* iteration's delta calculation
+            current_io_snapshot[counter_key] = current_io
+            # Calculate the delta by comparing current counters to counters from the *previous* snapshot
+            prev_io = previous_io_counters.get(counter_key)
+            if prev_io is not None:
+                # Calculate difference, ensure it's not negative (can happen on some platforms/cases)
+                read_delta = current_io.read_bytes - prev_io.read_bytes
+                if read_delta < 0: read_delta = 0
+                write_delta = current_io.write_bytes - prev_io.write_bytes
+                if write_delta < 0: write_delta = 0
+
+        # Store all collected and calculated data for this PID in the current snapshot's data dict
+        current_snapshot_data[pid] = {
+            'pid': pid,
+            'ppid': ppid,
+            'name': name,
+            'status': status,
+            'cpu_percent': cpu_val_per_core, # Store the per-core capped value
+            'mem_ws_kb': mem_ws_kb,
+            'delta_read_bytes': read_delta,
+            'delta_write_bytes': write_delta,
+        }
+
+    # --- Update global caches ---
+    # Replace previous_io_counters and previous_cpu_times for the NEXT iteration with the values from THIS snapshot.
+    # Processes that ended (or could not be queried) are implicitly dropped.
+    previous_io_counters = current_io_snapshot
+    previous_cpu_times = current_cpu_times
+
+
+
+
+# --- نخ‌های نوشتن در پس‌زمینه ---
+def _start_writer_thread(target, args, name, queue_size):
+    """Starts target(item_queue, *args) as a daemon writer thread fed by a new bounded queue.
+       Returns (item_queue, thread).
+    """
+    item_queue = queue.Queue(maxsize=queue_size)
+    thread = threading.Thread(target=target, args=(item_queue,) + args, name=name, daemon=True)
+    thread.start()
+    return item_queue, thread
+
+
+def _stop_writer_thread(item_queue, thread, description):
+    """Sends the None sentinel to a writer thread and waits for it to write what is queued (up to 5s per step).
+       Logs a warning if the thread is still running afterwards, since whatever it still holds is lost.
+    """
+    try:
+        item_queue.put(None, timeout=5)
+        thread.join(timeout=5)
+    except queue.Full:
+        pass # Reported below: the writer is still busy
+    if thread.is_alive():
+        logging.warning(f"The {description} writer did not drain its queue; some queued data was not written.")
+
+
+# --- نوشتن Snapshot در پس‌زمینه ---
+def _write_all(fd, data):
+    """Writes all of data to the raw descriptor fd, repeating os.write() after a partial write (signal, disk full)."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _snapshot_writer(text_queue, fd):
+    """Background thread that writes the snapshot texts from text_queue to the snapshot file descriptor.
+       Each snapshot is encoded and written as one buffer; a None item stops the thread.
+    """
+    while True:
+        text = text_queue.get()
+        if text is None: break # Monitoring stopped
+        try:
+            _write_all(fd, text.encode('utf-8'))
+        except Exception as e:
+            logging.error(f"Error writing snapshot file: {e}", exc_info=True)
+
+
+# --- نوشتن خلاصه سیستم (CSV / NDJSON) در پس‌زمینه ---
+def _summary_writer(row_queue, open_file, description):
+    """Background thread that writes system summary rows from row_queue to one summary file.
+       open_file() opens the file once and returns (file, write_row); a None item stops the thread after
+       flushing and closing the file.
+    """
+    try:
+        summary_file, write_row = open_file()
+    except Exception as e:
+        logging.error(f"Error opening {description} log: {e}", exc_info=True)
+        return
+
+    with summary_file:
+        rows_since_flush = 0
+        while True:
+            row = row_queue.get()
+            if row is None: break # Monitoring stopped
+            try:
+                write_row(row)
+                rows_since_flush += 1
+                if rows_since_flush >= SYSTEM_SUMMARY_FLUSH_EVERY:
+                    summary_file.flush()
+                    rows_since_flush = 0
+            except Exception as e:
+                logging.error(f"Error writing {description} log: {e}", exc_info=True)
+
+
+def _open_summary_csv(filename, fieldnames):
+    """Opens the system summary CSV for _summary_writer, writing the header if the file is missing or empty.
+       Rows are tuples already in the column order of fieldnames, so a plain csv.writer is enough.
+    """
+    # Decide once, before opening, whether the header is needed
+    need_header = not os.path.exists(filename) or os.path.getsize(filename) == 0
+    # Open the system summary CSV file in append mode, ensure newline='' for correct CSV writing
+    sys_summary_csv = open(filename, 'a', newline='', encoding='utf-8')
+    writer = csv.writer(sys_summary_csv)
+    if need_header:
+        writer.writerow(fieldnames)
+    return sys_summary_csv, writer.writerow
+
+
+def _ndjson_line(row):
+    """Serializes one system summary row (dict) to a UTF-8 JSON line, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(row, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _open_summary_ndjson(filename):
+    """Opens the system summary NDJSON file (binary append mode) for _summary_writer; one JSON object per line."""
+    sys_summary_ndjson = open(filename, 'ab')
+    write = sys_summary_ndjson.write
+    return sys_summary_ndjson, lambda row: write(_ndjson_line(row))
+
+
+def _queue_summary_row(row_queue, row, description, dropped):
+    """Hands a row to a summary writer without ever blocking the monitoring loop.
+       If the writer's queue is full the row is dropped; this is logged once per writer (tracked in dropped).
+    """
+    try:
+        row_queue.put_nowait(row)
+    except queue.Full:
+        if description not in dropped:
+            logging.warning("The %s writer is falling behind; dropping rows.", description)
+            dropped.add(description)
+
+
+# --- تابع لاگ درخت فرآیندی (بدون بازگشت) ---
 # این تابع از داده‌های جمع‌آوری و محاسبه شده در current_snapshot_data استفاده می‌کند
-# و منابع را برای گره فعلی و زیردرختش جمع می‌کند
-def log_process_tree(pid, children_map, cpu_cores, interval_duration, txt_handle, indent=""):
-    """Logs information for a process and its subtree using pre-collected data
-       and sums resources for the entire subtree rooted at pid.
+# و منابع را برای هر گره و زیردرختش جمع می‌کند
+_ERROR_STATUSES = ('access denied', 'error', 'fetch error', 'cpu error', 'mem error', 'io error')
+
+def log_process_tree(root_pid, children_map, cpu_cores, inv_interval, out):
+    """Logs information for every process of the tree rooted at root_pid using pre-collected data.
+       children_map must map each PID to its children in the snapshot, sorted by ascending PID.
+       Each line shows the resources summed over that process's entire subtree. The tree is walked
+       in post-order (children before their parent) with an explicit stack, so no recursion is needed
+       however deep the tree is.
+       inv_interval is 1/interval (computed once per snapshot), or 0 if the interval is too short for rates.
+       The lines are appended to out, a list of str that is encoded and written to the file once per snapshot.
+       Returns the summed resources of the whole tree.
     """
     global current_snapshot_data
 
     # If PID is not in current snapshot data (likely terminated), log its status and return zero sum
-    if pid not in current_snapshot_data:
+    if root_pid not in current_snapshot_data:
         try:
-            name_field_length = max(1, 45 - len(indent)) # Adjust width based on indent
-            txt_handle.write(f"{indent}{f'PID {pid}':<{name_field_length}}{str(pid):<8}{'Terminated/Missing':<15}{'-':<8}{'-':<12}{'-':<18}{'-':<10}\n")
+            out.append(_DISAPPEARED_FMT(f"PID {root_pid}", root_pid, 'Terminated/Missing', '-', '-', '-', '-'))
         except Exception:
-             txt_handle.write(f"{indent}Error logging terminated/missing process {pid}\n")
+             out.append(f"Error logging terminated/missing process {root_pid}\n")
         # Return zero sum for terminated processes, count as an error for the tree total
         return {'cpu': 0.0, 'ws_kb': 0, 'delta_read_bytes': 0, 'delta_write_bytes': 0, 'error_count': 1}
 
-
-    # Get pre-collected and calculated data for the current process
-    process_data = current_snapshot_data[pid]
-    process_name = process_data.get('name', 'N/A')
-    process_status = process_data.get('status', 'N/A')
-    # This CPU percentage is already scaled to ONE core and capped at 100%
-    own_cpu_per_core = process_data.get('cpu_percent', 0.0)
-    own_ws_kb = process_data.get('mem_ws_kb', 0)
-    own_delta_read_bytes = process_data.get('delta_read_bytes', 0)
-    own_delta_write_bytes = process_data.get('delta_write_bytes', 0)
-
-    # --- Recursively call for children and sum their resources ---
-    children_total = {'cpu': 0.0, 'ws_kb': 0, 'delta_read_bytes': 0, 'delta_write_bytes': 0, 'error_count': 0}
-    # Get children PIDs that were found in the *current* snapshot and are mapped as children
-    valid_children_pids = [p for p in children_map.get(pid, []) if p in current_snapshot_data]
-    sorted_children_pids = sorted(valid_children_pids)
-
-
-    for child_pid in sorted_children_pids:
-        # Recursively log and sum for each valid child
-        child_sum = log_process_tree(child_pid, children_map, cpu_cores, interval_duration, txt_handle, indent + INDENT_STRING)
-        children_total['cpu'] += child_sum['cpu']
-        children_total['ws_kb'] += child_sum['ws_kb']
-        children_total['delta_read_bytes'] += child_sum['delta_read_bytes']
-        children_total['delta_write_bytes'] += child_sum['delta_write_bytes']
-        children_total['error_count'] += child_sum['error_count']
-
-    # --- Calculate total resources for the current node (own resources + children's total) ---
-    # Total CPU here is the sum of per-core percentages for itself and its children
-    total_for_node = {
-        'cpu': own_cpu_per_core + children_total['cpu'],
-        'ws_kb': own_ws_kb + children_total['ws_kb'],
-        'delta_read_bytes': own_delta_read_bytes + children_total['delta_read_bytes'],
-        'delta_write_bytes': own_delta_write_bytes + children_total['delta_write_bytes'],
-        # Count errors: 1 if this node had a fetch error + errors from children
-        'error_count': (1 if process_status in ['access denied', 'error', 'fetch error', 'cpu error', 'mem error', 'io error'] else 0) + children_total['error_count']
-    }
-
-
-    # --- Format resource values for display ---
-    display_name = process_name
-    # Add count of valid children in parentheses if any
-    if valid_children_pids:
-         # Ensure the count is of children successfully processed, not just in children_map
-         # The current logic counts valid children based on current_snapshot_data check above
-         display_name += f" ({len(valid_children_pids)})"
-
-
-    # CPU display (sum of per-core percentages)
-    cpu_display = f"{total_for_node['cpu']:.1f}%"
-    # Memory display (Working Set in MB, converted from KB)
-    mem_display_mb = format_bytes_to_mb(total_for_node['ws_kb'] * 1024) # total_for_node['ws_kb'] is already in KB
-    mem_display = f"{mem_display_mb:,.1f} MB" if mem_display_mb >= 0.1 else ("0.0 MB" if total_for_node['ws_kb'] == 0 else "< 0.1 MB")
-
-    # Disk I/O Rate display (Read/Write MB/s over the interval)
-    disk_read_rate_bps = 0.0
-    disk_write_rate_bps = 0.0
-    if interval_duration > 0.01:
-         disk_read_rate_bps = total_for_node['delta_read_bytes'] / interval_duration
-         disk_write_rate_bps = total_for_node['delta_write_bytes'] / interval_duration
-
-    disk_read_display = format_rate_mbps(disk_read_rate_bps)
-    disk_write_display = format_rate_mbps(disk_write_rate_bps)
-    disk_display = "0.0 MB/s" if (disk_read_display == "0.0 MB/s" and disk_write_display == "0.0 MB/s") else f"{disk_read_display}/{disk_write_display}"
-
-    network_display = "N/A" # Network per process is difficult with psutil cross-platform
-    status_display = process_status
-
-    # --- Write the formatted line to the text file ---
-    # Calculate dynamic field length based on indent
-    name_field_length = max(1, 45 - len(indent)) # Ensure minimum length is 1
-
-
-    truncated_display_name = display_name
-    # Truncate if needed, leaving space for "..." if field is long enough
-    if len(truncated_display_name) > name_field_length and name_field_length > 3:
-        truncated_display_name = truncated_display_name[:name_field_length-3] + "..."
-    elif len(truncated_display_name) > name_field_length:
-         truncated_display_name = truncated_display_name[:name_field_length] # Truncate hard if field is too short
-
-
-    # Format the line with dynamic name field width and other fixed widths
-    line = (f"{indent}{truncated_display_name:<{name_field_length}}"
-            f"{str(pid):<8}"
-            f"{status_display:<15}"
-            f"{cpu_display:<8}" # Display the sum of per-core percentages
-            f"{mem_display:<12}"
-            f"{disk_display:<18}"
-            f"{network_display:<10}")
-    txt_handle.write(line + '\n')
-
-    return total_for_node # Return the total resources for this subtree
+    # --- Walk the subtree in post-order with an explicit stack, emitting one line per process ---
+    # A process with children is pushed back (marked as expanded) below its children, which are pushed
+    # in descending PID order so they pop in ascending order. Every child is therefore emitted before its
+    # parent, which is the output order of the snapshot file, and its subtree totals are known
+    # by the time the parent is emitted.
+    totals = {} # pid -> (cpu, ws_kb, delta_read_bytes, delta_write_bytes) of its subtree
+    # Errors are only reported for the whole tree
+    error_count = 0
+    stack = [(root_pid, 0, False)]
+    while stack:
+        pid, depth, expanded = stack.pop()
+        # Children PIDs found in the *current* snapshot (children_map lists are built sorted, in-snapshot only)
+        valid_children_pids = children_map.get(pid, ())
+        if valid_children_pids and not expanded:
+            stack.append((pid, depth, True))
+            stack.extend((child_pid, depth + 1, False) for child_pid in reversed(valid_children_pids))
+            continue
+
+        process_data = current_snapshot_data[pid]
+        process_status = process_data.get('status', 'N/A')
+
+        # Own resources (CPU is already scaled to ONE core and capped at 100%) plus children's totals,
+        # which are already known because children were visited first
+        cpu = process_data.get('cpu_percent', 0.0)
+        ws_kb = process_data.get('mem_ws_kb', 0)
+        delta_read_bytes = process_data.get('delta_read_bytes', 0)
+        delta_write_bytes = process_data.get('delta_write_bytes', 0)
+        # Count errors: 1 if this node had a fetch error
+        if process_status in _ERROR_STATUSES:
+            error_count += 1
+        for child_pid in valid_children_pids:
+            child_cpu, child_ws_kb, child_read, child_write = totals.pop(child_pid)
+            cpu += child_cpu
+            ws_kb += child_ws_kb
+            delta_read_bytes += child_read
+            delta_write_bytes += child_write
+        totals[pid] = (cpu, ws_kb, delta_read_bytes, delta_write_bytes)
+
+        # --- Format resource values for display ---
+        display_name = process_data.get('name', 'N/A')
+        # Add count of valid children in parentheses if any
+        if valid_children_pids:
+             display_name += f" ({len(valid_children_pids)})"
+
+        # CPU display (sum of per-core percentages)
+        cpu_display = f"{cpu:.1f}%"
+        # Memory display (Working Set in MB, converted from KB)
+        mem_display = format_mb_display(ws_kb)
+
+        # Disk I/O Rate display (Read/Write MB/s over the interval)
+        disk_read_display = format_rate_mbps(delta_read_bytes * inv_interval)
+        disk_write_display = format_rate_mbps(delta_write_bytes * inv_interval)
+        disk_display = "0.0 MB/s" if (disk_read_display == "0.0 MB/s" and disk_write_display == "0.0 MB/s") else f"{disk_read_display}/{disk_write_display}"
+
+        network_display = "N/A" # Network per process is difficult with psutil cross-platform
+        status_display = process_status
+
+        # --- Build the formatted line ---
+        # Name field width and line formatter (indent included) for this depth
+        name_field_length, format_line = _LINE_LAYOUTS[depth] if depth < 64 else _make_line_layout(depth)
+
+        truncated_display_name = display_name
+        # Truncate if needed, leaving space for "..." if field is long enough
+        if len(truncated_display_name) > name_field_length and name_field_length > 3:
+            truncated_display_name = truncated_display_name[:name_field_length-3] + "..."
+        elif len(truncated_display_name) > name_field_length:
+             truncated_display_name = truncated_display_name[:name_field_length] # Truncate hard if field is too short
+
+        # Format the line: name, PID, status, CPU (sum of per-core percentages), memory, disk, network
+        out.append(format_line(truncated_display_name, pid, status_display, cpu_display,
+                               mem_display, disk_display, network_display))
+
+    cpu, ws_kb, delta_read_bytes, delta_write_bytes = totals[root_pid]
+    return {'cpu': cpu, 'ws_kb': ws_kb, 'delta_read_bytes': delta_read_bytes,
+            'delta_write_bytes': delta_write_bytes, 'error_count': error_count} # Return the total resources for this tree
 
 
 # --- تابع اصلی مانیتورینگ ---
@@ -270,6 +654,8 @@ def monitor_like_task_manager(repeat_interval_seconds, target_app_name=None):
         logging.info(f"Overall system summary: {SYSTEM_SUMMARY_FILENAME}")
     else:
         logging.info("System summary CSV output is disabled.")
+    if ENABLE_SYSTEM_SUMMARY_NDJSON:
+        logging.info(f"Overall system summary (NDJSON, {'orjson' if orjson is not None else 'json'}): {SYSTEM_SUMMARY_FILENAME_NDJSON}")
 
 
     cpu_cores = get_cpu_cores()
@@ -277,376 +663,255 @@ def monitor_like_task_manager(repeat_interval_seconds, target_app_name=None):
     logging.info(f"Detected {cpu_cores} logical CPU cores. Process CPU will be shown as percentage of ONE core.")
 
 
-    # Check if system summary file exists and has content *only if* writing is enabled
-    system_summary_header_written = False
+    # Open the snapshot file first (again, if a previous monitoring run closed it), before any writer thread starts
+    global _snap_fd
+    if _snap_fd is None:
+        _snap_fd = _open_snapshot_file()
+
+    # Start a background writer for each enabled summary output *only if* it is enabled, so disk latency
+    # stays out of the monitoring loop. Each is None or (description, row_queue, thread).
+    summary_csv = summary_ndjson = None
     if ENABLE_SYSTEM_SUMMARY_CSV:
-        system_summary_header_written = os.path.exists(SYSTEM_SUMMARY_FILENAME) and os.path.getsize(SYSTEM_SUMMARY_FILENAME) > 0
+        open_csv = lambda: _open_summary_csv(SYSTEM_SUMMARY_FILENAME, system_summary_header)
+        summary_csv = ("system summary CSV",) + _start_writer_thread(
+            _summary_writer, (open_csv, "system summary CSV"), "system-summary-csv-writer", SYSTEM_SUMMARY_QUEUE_SIZE)
+    if ENABLE_SYSTEM_SUMMARY_NDJSON:
+        open_ndjson = lambda: _open_summary_ndjson(SYSTEM_SUMMARY_FILENAME_NDJSON)
+        summary_ndjson = ("system summary NDJSON",) + _start_writer_thread(
+            _summary_writer, (open_ndjson, "system summary NDJSON"), "system-summary-ndjson-writer", SYSTEM_SUMMARY_QUEUE_SIZE)
+    summary_rows_dropped = set() # Descriptions of the summary writers whose dropped rows have already been logged
+
+    # The snapshot text is written by a background thread too, so disk latency does not eat into the interval
+    snapshot_queue, snapshot_writer_thread = _start_writer_thread(_snapshot_writer, (_snap_fd,), "snapshot-writer",
+                                                                  SNAPSHOT_WRITE_QUEUE_SIZE)
 
     target_app_name_lower = target_app_name.lower() if target_app_name else None
 
-    # last_snapshot_time needs to be initialized before the loop starts to calculate the first interval
-    last_snapshot_time = time.time()
+    # last_snapshot_time needs to be initialized before the loop starts to calculate the first interval.
+    # All interval timing uses time.monotonic(), which never jumps when the wall clock is adjusted (NTP, DST)
+    last_snapshot_time = time.monotonic()
+    next_deadline = None # Absolute monotonic time the next snapshot is due; anchored on the first snapshot
 
-    global previous_io_counters, process_objects_cache, current_snapshot_data
+    global current_snapshot_data
     # These caches and previous_io_counters persist between loop iterations
     # They should be cleared only ONCE at the very start of the script execution (__main__ block)
 
     try:
-        # Open the snapshot text file in append mode, ensuring UTF-8 encoding
-        with open(SNAPSHOT_FILENAME_TXT, 'a', encoding='utf-8') as txt_snapshot_log:
-            # Write header lines if the file is empty
-            if os.path.getsize(SNAPSHOT_FILENAME_TXT) == 0:
-                name_width_header = 45 # Fixed width for the Name column header
-                header_line = (f"{'Name':<{name_width_header}}"
-                               f"{'PID':<8}{'Status':<15}{'CPU%':<8}" # CPU% is per ONE core
-                               f"{'Memory':<12}{'Disk (R/W MB/s)':<18}{'Network':<10}\n")
-                txt_snapshot_log.write(header_line)
-                txt_snapshot_log.write("-" * (name_width_header + 8 + 15 + 8 + 12 + 18 + 10) + "\n")
-
-
-            # --- Main monitoring loop ---
-            while True:
-                snapshot_start_time = time.time()
-                # Calculate the actual duration since the end of the last snapshot processing
-                # This is used for calculating rates (Disk I/O) over the interval
-                actual_interval_duration = snapshot_start_time - last_snapshot_time
-
-                # If the interval was too short, wait a bit to get more meaningful deltas
-                if actual_interval_duration < 0.5:
-                     sleep_short = 0.5 - actual_interval_duration
-                     if sleep_short > 0:
-                          time.sleep(sleep_short)
-                          snapshot_start_time = time.time() # Recalculate start time and duration after waiting
-                          actual_interval_duration = snapshot_start_time - last_snapshot_time
-
-                last_snapshot_time = snapshot_start_time # Update the time for the next iteration's interval calculation
-
-                now = datetime.datetime.now()
-                timestamp_str = now.strftime("%Y-%m-%d %H:%M:%S")
-                logging.info(f"--- Snapshot @ {timestamp_str} (Interval: {actual_interval_duration:.2f}s) ---")
-
-                # --- 1. Collect raw data for all processes and calculate metrics (CPU%, Memory, IO Delta) ---
-                # Clear data from the previous snapshot before populating for the current one
-                current_snapshot_data.clear()
-                current_io_snapshot = {} # Temporary dict to store I/O counters for THIS snapshot
-                pids_found_this_iter = set() # Keep track of PIDs seen in this iteration
-                newly_cached_pids = [] # PIDs added/re-cached in this iteration for priming
-
-
-                logging.debug("Collecting process data and calculating metrics...")
-                try:
-                    # Fetch basic info for all processes first
-                    all_processes_this_iter = list(psutil.process_iter(['pid', 'ppid', 'name', 'status'], ad_value=None))
-
-                    # Iterate through processes to collect detailed data and calculate metrics
-                    for proc in all_processes_this_iter:
-                        # Skip if essential info is missing
-                        if proc.info is None or proc.info.get('pid') is None: continue
-
-                        pid = proc.info['pid']
-                        pids_found_this_iter.add(pid)
-
-                        # Try to get the process object, reuse from cache if possible
-                        process = None
-                        try:
-                            # Reuse from cache if running, otherwise get new object for this PID
-                            if pid in process_objects_cache and process_objects_cache[pid].is_running():
-                                process = process_objects_cache[pid]
-                            else:
-                                process = psutil.Process(pid) # Get a new process object
-                                process_objects_cache[pid] = process # Cache the new object
-                                newly_cached_pids.append(pid) # Add to list for priming
-                                # logging.debug(f"Cached/Re-cached PID {pid}") # Log moved to priming block
-
-                        except (psutil.NoSuchProcess, psutil.AccessDenied):
-                            # Handle processes that terminated or became inaccessible during the iteration
-                            if pid in process_objects_cache: del process_objects_cache[pid] # Remove from object cache
-                            # No need to remove from previous_io_counters here as it's fully replaced later
-                            # logging.debug(f"Process {pid} ended/inaccessible during iteration.") # Log moved outside loop
-                            # Add a minimal entry to current_snapshot_data to mark its status
-                            current_snapshot_data[pid] = {'pid': pid, 'ppid': proc.info.get('ppid'),
-                                                           'name': proc.info.get('name', 'N/A'),
-                                                           'status': proc.info.get('status', 'terminated'), # Explicitly set status to terminated
-                                                           'cpu_percent': 0.0, 'mem_ws_kb': 0,
-                                                           'delta_read_bytes': 0, 'delta_write_bytes': 0}
-                            continue # Skip fetching other details if process object is not available
-
-
-                        # --- Fetch specific resources for the process object ---
-                        ppid = proc.info.get('ppid', None)
-                        name = proc.info.get('name', 'N/A') or 'N/A' # Use name from proc.info as primary
-                        status = proc.info.get('status', 'N/A') # Use status from proc.info as primary
-
-                        # CPU usage percentage (relative to ONE logical core, capped at 100%)
-                        cpu_val_per_core = 0.0
-                        try:
-                            # Get CPU usage since the last call to process.cpu_percent(None) for this object.
-                            # This value is relative to the total capacity across ALL logical cores.
-                            raw_cpu_total_cores = process.cpu_percent(interval=None)
-                            # Scale it to be a percentage of a SINGLE logical core
-                            scaled_cpu = raw_cpu_total_cores / cpu_cores if cpu_cores > 0 else raw_cpu_total_cores
-                            # Cap the percentage at 100% per process, mimicking Task Manager's process list view
-                            cpu_val_per_core = min(100.0, scaled_cpu)
-
-                        except (psutil.NoSuchProcess, psutil.AccessDenied, Exception) as e:
-                             # Update status if a resource-specific error occurs, unless it's already terminated/access denied
-                             if status not in ['terminated', 'access denied']: status = f'cpu error'
-                             logging.debug(f"Error fetching CPU for P{pid}: {e}", exc_info=False)
-
-
-                        # Memory usage (Resident Set Size in KB)
-                        mem_ws_kb = 0
-                        try:
-                            mem_info = process.memory_info()
-                            mem_ws_kb = mem_info.rss // 1024 # Resident Set Size is often used as a proxy for Working Set
-                        except (psutil.NoSuchProcess, psutil.AccessDenied, Exception) as e:
-                            if status not in ['terminated', 'access denied', 'cpu error']: status = f'mem error'
-                            logging.debug(f"Error fetching Mem for P{pid}: {e}", exc_info=False)
-
-                        # Disk I/O Delta (bytes read/written during the *last* interval)
-                        current_io = None
-                        read_delta = 0
-                        write_delta = 0
-                        try:
-                            current_io = process.io_counters()
-                            # Store the current I/O counters object for this PID, to be used in the *next* iteration's delta calculation
-                            current_io_snapshot[pid] = current_io
-
-                            # Calculate the delta by comparing current counters to counters from the *previous* snapshot
-                            if pid in previous_io_counters:
-                                prev_io = previous_io_counters[pid]
-                                # Calculate difference, ensure it's not negative (can happen on some platforms/cases)
-                                read_delta = max(0, current_io.read_bytes - prev_io.read_bytes)
-                                write_delta = max(0, current_io.write_bytes - prev_io.write_bytes)
-                            else:
-                                # If this is the first time we see this PID in previous_io_counters,
-                                # the delta over the "interval" is considered 0 for rate calculation.
-                                read_delta = 0
-                                write_delta = 0
-
-                        except (psutil.NoSuchProcess, psutil.AccessDenied, NotImplementedError, OSError) as e:
-                            # Handle I/O specific errors
-                            if status not in ['terminated', 'access denied', 'cpu error', 'mem error']: status = f'io error'
-                            logging.debug(f"Error fetching IO for P{pid}: {e}", exc_info=False)
-                        except Exception as e:
-                            # Handle any other unexpected errors during resource fetching
-                            if status not in ['terminated', 'access denied', 'cpu error', 'mem error', 'io error']: status = f'fetch error'
-                            logging.warning(f"Unexpected Err fetching resources P{pid}: {e}", exc_info=False)
-
-
-                        # Store all collected and calculated data for this PID in the current snapshot's data dict
-                        current_snapshot_data[pid] = {
-                            'pid': pid,
-                            'ppid': ppid,
-                            'name': name,
-                            'status': status,
-                            'cpu_percent': cpu_val_per_core, # Store the per-core capped value
-                            'mem_ws_kb': mem_ws_kb,
-                            'delta_read_bytes': read_delta,
-                            'delta_write_bytes': write_delta,
-                        }
+        # Write header lines if the file is empty
+        if os.fstat(_snap_fd).st_size == 0:
+            name_width_header = 45 # Fixed width for the Name column header
+            header_line = (f"{'Name':<{name_width_header}}"
+                           f"{'PID':<8}{'Status':<15}{'CPU%':<8}" # CPU% is per ONE core
+                           f"{'Memory':<12}{'Disk (R/W MB/s)':<18}{'Network':<10}\n")
+            _write_all(_snap_fd, (header_line + "-" * (name_width_header + 8 + 15 + 8 + 12 + 18 + 10) + "\n").encode('utf-8'))
+
+        # The whole snapshot is collected here as text and written with one write() per snapshot
+        snapshot_parts = []
+
+
+        # --- Main monitoring loop ---
+        while True:
+            snapshot_start_time = time.monotonic()
+            # Calculate the actual duration since the end of the last snapshot processing
+            # This is used for calculating rates (Disk I/O) over the interval
+            actual_interval_duration = snapshot_start_time - last_snapshot_time
+
+            # If the interval was too short, wait a bit to get more meaningful deltas
+            if actual_interval_duration < 0.5:
+                 sleep_short = 0.5 - actual_interval_duration
+                 if sleep_short > 0:
+                      time.sleep(sleep_short)
+                      snapshot_start_time = time.monotonic() # Recalculate start time and duration after waiting
+                      actual_interval_duration = snapshot_start_time - last_snapshot_time
+
+            last_snapshot_time = snapshot_start_time # Update the time for the next iteration's interval calculation
+
+            now = datetime.datetime.now()
+            timestamp_str = now.strftime("%Y-%m-%d %H:%M:%S")
+            logging.info("--- Snapshot @ %s (Interval: %.2fs) ---", timestamp_str, actual_interval_duration)
+
+            # --- 1. Collect raw data for all processes and calculate metrics (CPU%, Memory, IO Delta) ---
+            # Clear data from the previous snapshot before populating for the current one
+            current_snapshot_data.clear()
+            target_pids_found = set() # PIDs matching the target application name, filled by the collector
+
+            logging.debug("Collecting process data and calculating metrics...")
+            try:
+                if USE_PROCFS_FAST_PATH:
+                    _collect_linux_fast(actual_interval_duration, target_app_name_lower, target_pids_found)
+                else:
+                    _collect_psutil(actual_interval_duration, target_app_name_lower, target_pids_found)
+                # Log the total number of processes for which data was collected in this snapshot
+                logging.debug("Collected data for %d processes.", len(current_snapshot_data))
+
+            except Exception as e:
+                # Handle critical errors during the data collection phase itself
+                logging.critical(f"Critical error during process data collection: {e}", exc_info=True)
+                print(f"Error collecting process data. Check '{LOG_FILENAME}'.")
+                # Sleep for the requested interval before the next attempt
+                time.sleep(repeat_interval_seconds)
+                continue # Skip the rest of the loop for this snapshot if data collection failed
+
+
+            # --- 2. Build process tree structure and identify roots ---
+            # The process_map_for_tree will be used by the tree logging function.
+            # It uses the data already processed and stored in current_snapshot_data.
+            process_map_for_tree = current_snapshot_data
+
+            # children_map maps parent PIDs to lists of child PIDs found in the current snapshot
+            children_map = defaultdict(list)
+            # Set-like view of the PIDs in this snapshot (O(1) membership)
+            all_pids_in_snapshot = current_snapshot_data.keys()
+            root_candidates = set() # PIDs that appear to be roots (ppid 0, None, or parent not in snapshot)
+
+            # Iterate through the collected data (in ascending PID order, so every children_map list
+            # comes out already sorted and needs no per-node sort) to build the children map and find roots
+            for pid in sorted(current_snapshot_data):
+                 data = current_snapshot_data[pid]
+                 ppid = data.get('ppid')
+                 # Add to children_map only if the parent is also in the current snapshot data.
+                 # Otherwise the process is a root candidate: its parent is PID 0 (system), None,
+                 # or its parent PID exists but was not found in this snapshot.
+                 if ppid and ppid in all_pids_in_snapshot: # ppid is an int or None, so this skips None and 0
+                      children_map[ppid].append(pid)
+                 else:
+                     root_candidates.add(pid)
+
+
+            # Determine which root PIDs to log based on filtering settings
+            root_pids_to_log = []
+            if target_app_name:
+                 # If filtering, find the roots of the trees containing the target app processes
+                 if not target_pids_found:
+                     logging.info("Target '%s' not found in this snapshot.", target_app_name)
+                     root_pids_to_log = [] # No roots to log if target not found
+                 else:
+                     # Trace up from the target processes to find their highest ancestor roots within the snapshot
+                     roots_of_target_trees = set()
+                     search_queue = deque(target_pids_found) # Start search from target PIDs
+                     visited = set(target_pids_found) # Keep track of visited PIDs to avoid infinite loops
+
+                     while search_queue:
+                          current_pid = search_queue.popleft()
+
+                          if current_pid in root_candidates:
+                               # Found a root or a process whose parent is not in the current snapshot -> add to roots
+                               roots_of_target_trees.add(current_pid)
+                               continue
+
+                          # Not a root, so its parent is in the current snapshot
+                          ppid = current_snapshot_data[current_pid]['ppid']
+                          if ppid not in visited:
+                               # Move up to the parent if not already visited
+                               visited.add(ppid)
+                               search_queue.append(ppid)
+
+                     # Sort the root PIDs for consistent output order
+                     root_pids_to_log = sorted(roots_of_target_trees)
+                     logging.info("Identified %d root(s) for '%s'.", len(root_pids_to_log), target_app_name)
+
+            else: # No target app specified, log all identified root trees
+                 root_pids_to_log = sorted(root_candidates)
+                 logging.debug("Identified %d main trees to log.", len(root_pids_to_log))
+
+
+            # --- 3. Write process tree(s) to the snapshot text file ---
+            snapshot_parts.clear()
+            snapshot_parts.append(f"\n--- Snapshot @ {timestamp_str} ---\n")
+            if not root_pids_to_log:
+                # Message if no processes were found matching the criteria
+                snapshot_parts.append(f"No processes found matching criteria"
+                                      f"{f' for {target_app_name}' if target_app_name else ''}.\n")
+            else:
+                total_errors_in_log = 0 # Counter for errors encountered during tree logging
+                # Reciprocal of the interval, to convert each node's I/O delta to a rate
+                inv_interval = 1.0 / actual_interval_duration if actual_interval_duration > 0.01 else 0.0
+                # Iterate through the determined root PIDs and log their trees
+                for root_pid in root_pids_to_log:
+                     # Ensure the root PID is still present in the snapshot data before attempting to log its tree
+                     if root_pid in process_map_for_tree:
+                         # Call the tree logging function. It uses current_snapshot_data internally.
+                         subtree_info = log_process_tree(root_pid, children_map, cpu_cores, inv_interval, snapshot_parts)
+                         total_errors_in_log += subtree_info.get('error_count', 0)
+                     else:
+                          # Handle cases where a root process disappeared between building the list and logging
+                          logging.warning("Root PID %s disappeared just before logging process tree.", root_pid)
+                          # Log a line indicating the disappeared root
+                          try:
+                               snapshot_parts.append(_DISAPPEARED_FMT(f"PID {root_pid}", root_pid, 'Disappeared', '-', '-', '-', '-'))
+                          except Exception:
+                               snapshot_parts.append(f"Error logging disappeared root process {root_pid}\n")
 
-                    # --- Priming CPU and IO for newly cached/re-cached processes ---
-                    # After collecting data for all processes, iterate through those whose objects
-                    # were newly obtained or re-obtained in this iteration. Call cpu_percent(None)
-                    # and io_counters() once to reset their internal counters. This ensures the
-                    # *next* call in the subsequent loop iteration measures usage over the interval.
-                    if newly_cached_pids:
-                        logging.debug(f"Priming {len(newly_cached_pids)} new/re-cached PIDs...")
-                    for pid_to_prime in newly_cached_pids:
-                         # Ensure the process object is still in the cache before priming
-                         if pid_to_prime in process_objects_cache:
-                             try:
-                                 # Calling cpu_percent(None) once resets its internal timer
-                                 process_objects_cache[pid_to_prime].cpu_percent(interval=None)
-                                 # Calling io_counters() once and storing it ensures delta calculation
-                                 # is correct from the next interval onwards.
-                                 primed_io = process_objects_cache[pid_to_prime].io_counters()
-                                 previous_io_counters[pid_to_prime] = primed_io # Store this as the "previous" for the *next* iter
-                                 current_io_snapshot[pid_to_prime] = primed_io # Also ensure it's in current_io_snapshot if it wasn't fetched above
-
-                             except Exception:
-                                 pass # Ignore errors during priming
-
-                    # Log the total number of processes for which data was collected in this snapshot
-                    logging.debug(f"Collected data for {len(current_snapshot_data)} processes.")
 
-                except Exception as e:
-                    # Handle critical errors during the data collection phase itself
-                    logging.critical(f"Critical error during process data collection: {e}", exc_info=True)
-                    print(f"Error collecting process data. Check '{LOG_FILENAME}'.")
-                    # Sleep for the requested interval before the next attempt
-                    time.sleep(repeat_interval_seconds)
-                    continue # Skip the rest of the loop for this snapshot if data collection failed
-
-
-                # --- 2. Update global caches and clean up terminated processes ---
-                # Update previous_io_counters for the NEXT iteration by storing the counters from THIS snapshot
-                # This replaces the previous state entirely based on successful queries in this iteration.
-                # Processes not in current_io_snapshot will implicitly be missing from previous_io_counters for the next iter.
-                previous_io_counters = current_io_snapshot
-
-
-                # Clean up process object cache: remove objects for PIDs that were not found in this iteration
-                pids_to_remove_from_cache = set(process_objects_cache.keys()) - pids_found_this_iter
-                for pid in pids_to_remove_from_cache:
-                    if pid in process_objects_cache:
-                         del process_objects_cache[pid]
-                    # Note: No need to explicitly remove from previous_io_counters here
-                    # because it's completely overwritten by current_io_snapshot above.
-
-                if pids_to_remove_from_cache:
-                     logging.debug(f"Removed {len(pids_to_remove_from_cache)} ended PIDs from process object cache.")
-
-
-                # --- 3. Build process tree structure and identify roots ---
-                # The process_map_for_tree will be used by the recursive logging function.
-                # It uses the data already processed and stored in current_snapshot_data.
-                process_map_for_tree = current_snapshot_data
-
-                # children_map maps parent PIDs to lists of child PIDs found in the current snapshot
-                children_map = defaultdict(list)
-                all_pids_in_snapshot = set(current_snapshot_data.keys())
-                target_pids_found = set() # PIDs matching the target application name
-                root_candidates = set() # PIDs that appear to be roots (ppid 0, None, or parent not in snapshot)
-
-                # Iterate through the collected data to build the children map and find roots/targets
-                for pid, data in current_snapshot_data.items():
-                     ppid = data.get('ppid')
-                     # Add to children_map only if the parent is also in the current snapshot data
-                     if ppid is not None and ppid != 0 and ppid in all_pids_in_snapshot:
-                          children_map[ppid].append(pid)
-
-                     # A process is a root candidate if its parent is PID 0 (system), None,
-                     # or if its parent PID exists but was not found in this snapshot.
-                     if ppid is None or ppid == 0 or ppid not in all_pids_in_snapshot:
-                         root_candidates.add(pid)
-
-                     # Identify processes matching the target application name (case-insensitive)
-                     if target_app_name_lower and data.get('name', '').lower() == target_app_name_lower:
-                         target_pids_found.add(pid)
-
-
-                # Determine which root PIDs to log based on filtering settings
-                root_pids_to_log = []
-                if target_app_name:
-                     # If filtering, find the roots of the trees containing the target app processes
-                     if not target_pids_found:
-                         logging.info(f"Target '{target_app_name}' not found in this snapshot.")
-                         root_pids_to_log = [] # No roots to log if target not found
-                     else:
-                         # Trace up from the target processes to find their highest ancestor roots within the snapshot
-                         roots_of_target_trees = set()
-                         search_queue = list(target_pids_found); # Start search from target PIDs
-                         visited = set(target_pids_found) # Keep track of visited PIDs to avoid infinite loops
-
-                         while search_queue:
-                              current_pid = search_queue.pop(0)
-                              data = current_snapshot_data.get(current_pid)
-                              if not data: continue # Should not happen if starting from target_pids_found
-
-                              ppid = data.get('ppid')
-
-                              if ppid is None or ppid == 0 or ppid not in all_pids_in_snapshot:
-                                   # Found a root or a process whose parent is not in the current snapshot -> add to roots
-                                   roots_of_target_trees.add(current_pid)
-                              elif ppid not in visited:
-                                   # Move up to the parent if not already visited
-                                   visited.add(ppid)
-                                   search_queue.append(ppid)
-
-                         # Sort the root PIDs for consistent output order
-                         root_pids_to_log = sorted(list(roots_of_target_trees))
-                         logging.info(f"Identified {len(root_pids_to_log)} root(s) for '{target_app_name}'.")
-
-                else: # No target app specified, log all identified root trees
-                     root_pids_to_log = sorted(list(root_candidates))
-                     logging.debug(f"Identified {len(root_pids_to_log)} main trees to log.")
-
-
-                # --- 4. Write process tree(s) to the snapshot text file ---
-                txt_snapshot_log.write(f"\n--- Snapshot @ {timestamp_str} ---\n")
-                if not root_pids_to_log:
-                    # Message if no processes were found matching the criteria
-                    txt_snapshot_log.write(f"No processes found matching criteria"
-                                           f"{f' for {target_app_name}' if target_app_name else ''}.\n")
-                else:
-                    total_errors_in_log = 0 # Counter for errors encountered during tree logging
-                    # Iterate through the determined root PIDs and log their trees recursively
-                    for root_pid in root_pids_to_log:
-                         # Ensure the root PID is still present in the snapshot data before attempting to log its tree
-                         if root_pid in process_map_for_tree:
-                             # Call the recursive logging function. It uses current_snapshot_data internally.
-                             subtree_info = log_process_tree(root_pid, children_map, cpu_cores, actual_interval_duration, txt_snapshot_log)
-                             total_errors_in_log += subtree_info.get('error_count', 0)
-                         else:
-                              # Handle cases where a root process disappeared between building the list and logging
-                              logging.warning(f"Root PID {root_pid} disappeared just before logging process tree.")
-                              # Log a line indicating the disappeared root
-                              try:
-                                   name_field_length = max(1, 45) # Fixed width for root lines
-                                   txt_snapshot_log.write(f"{f'PID {root_pid}':<{name_field_length}}{str(root_pid):<8}{'Disappeared':<15}{'-':<8}{'-':<12}{'-':<18}{'-':<10}\n")
-                              except Exception:
-                                   txt_snapshot_log.write(f"Error logging disappeared root process {root_pid}\n")
-
-
-                    # Log the total number of errors encountered during this snapshot's tree logging
-                    logging.info(f"Snapshot logged. Errors encountered: {total_errors_in_log}")
-                    # Ensure data is written to the file immediately
-                    txt_snapshot_log.flush()
-
-
-                # --- 5. Log system-wide summary to CSV file (Conditional based on settings) ---
-                if ENABLE_SYSTEM_SUMMARY_CSV: # <<< This block is executed only if the setting is True
-                    try:
-                        # Get system-wide metrics (CPU is total usage across all cores here, usually matching Performance tab)
-                        total_cpu_overall = psutil.cpu_percent(interval=None) # System-wide CPU since last call
-                        total_mem = psutil.virtual_memory() # System-wide RAM usage
-                        total_swap = psutil.swap_memory() # System-wide Swap usage
-                        disk_io_sys = psutil.disk_io_counters() # Cumulative system-wide disk I/O counters
-                        net_io_sys = psutil.net_io_counters() # Cumulative system-wide network I/O counters
-
-                        # Prepare data row as a dictionary matching the header
-                        system_summary_data = {
-                            "Timestamp": timestamp_str,
-                            "Total CPU Usage (%) (All Cores)": f"{total_cpu_overall:.2f}",
-                            "Total RAM Usage (%)": f"{total_mem.percent:.2f}",
-                            "Total SWAP Usage (%)": f"{total_swap.percent:.2f}",
-                            "Disk Read Count (Cumulative)": disk_io_sys.read_count if disk_io_sys else 0,
-                            "Disk Write Count (Cumulative)": disk_io_sys.write_count if disk_io_sys else 0,
-                            "Disk Read MB (Cumulative)": f"{format_bytes_to_mb(disk_io_sys.read_bytes):.2f}" if disk_io_sys else "0.00",
-                            "Disk Write MB (Cumulative)": f"{format_bytes_to_mb(disk_io_sys.write_bytes):.2f}" if disk_io_sys else "0.00",
-                            "Net Sent MB (Cumulative)": f"{format_bytes_to_mb(net_io_sys.bytes_sent):.2f}" if net_io_sys else "0.00",
-                            "Net Received MB (Cumulative)": f"{format_bytes_to_mb(net_io_sys.bytes_recv):.2f}" if net_io_sys else "0.00"
-                        }
+                # Log the total number of errors encountered during this snapshot's tree logging
+                logging.info("Snapshot logged. Errors encountered: %d", total_errors_in_log)
+
+            # Hand the whole snapshot to the background writer as one string (waits only if the writer is far behind)
+            snapshot_queue.put(''.join(snapshot_parts))
 
-                        # Open the system summary CSV file in append mode, ensure newline='' for correct CSV writing
-                        with open(SYSTEM_SUMMARY_FILENAME, 'a', newline='', encoding='utf-8') as sys_summary_csv:
-                            writer = csv.DictWriter(sys_summary_csv, fieldnames=system_summary_header)
-                            # Write the header row only if the file is empty
-                            if not system_summary_header_written:
-                                # Check if the file is empty by seeking to the end and checking the position
-                                sys_summary_csv.seek(0, os.SEEK_END);
-                                if sys_summary_csv.tell() == 0:
-                                    writer.writeheader()
-                                system_summary_header_written = True # Mark header as written for subsequent iterations
-
-                            # Write the data row for the current snapshot
-                            writer.writerow(system_summary_data)
-                        logging.debug(f"Sys summary: CPU={total_cpu_overall:.2f}%, RAM={total_mem.percent:.2f}%, SWAP={total_swap.percent:.2f}%")
-                    except Exception as e:
-                        logging.error(f"Error writing system summary log: {e}", exc_info=True)
-                # <<< End of conditional block for SYSTEM_SUMMARY_CSV
-
-
-                # --- 6. Sleep until the next interval is due ---
-                snapshot_end_time = time.time()
-                elapsed_time = snapshot_end_time - snapshot_start_time # Time taken for this snapshot processing
-                # Calculate remaining time to sleep to meet the repeat_interval_seconds
-                # Ensure minimum sleep time even if processing took longer than the interval (min 0.5s)
-                sleep_time = max(0.5, repeat_interval_seconds - elapsed_time)
-                logging.info(f"Snapshot processing took {elapsed_time:.2f}s. Sleeping for {sleep_time:.2f}s...")
-                time.sleep(sleep_time) # Pause execution
+
+            # --- 4. Log system-wide summary to CSV / NDJSON file (Conditional based on settings) ---
+            if ENABLE_SYSTEM_SUMMARY_CSV or ENABLE_SYSTEM_SUMMARY_NDJSON: # <<< Executed only if a summary output is enabled
+                try:
+                    # Get system-wide metrics (CPU is total usage across all cores here, usually matching Performance tab)
+                    total_cpu_overall = psutil.cpu_percent(interval=None) # System-wide CPU since last call
+                    total_mem = psutil.virtual_memory() # System-wide RAM usage
+                    total_swap = psutil.swap_memory() # System-wide Swap usage
+                    disk_io_sys = psutil.disk_io_counters() # Cumulative system-wide disk I/O counters
+                    net_io_sys = psutil.net_io_counters() # Cumulative system-wide network I/O counters
+
+                    if summary_csv is not None:
+                        # Prepare data row as a tuple in the same column order as system_summary_header
+                        system_summary_data = (
+                            timestamp_str, # Timestamp
+                            _fmt2(total_cpu_overall), # Total CPU Usage (%) (All Cores)
+                            _fmt2(total_mem.percent), # Total RAM Usage (%)
+                            _fmt2(total_swap.percent), # Total SWAP Usage (%)
+                            disk_io_sys.read_count if disk_io_sys else 0, # Disk Read Count (Cumulative)
+                            disk_io_sys.write_count if disk_io_sys else 0, # Disk Write Count (Cumulative)
+                            _fmt2(format_bytes_to_mb(disk_io_sys.read_bytes)) if disk_io_sys else "0.00", # Disk Read MB (Cumulative)
+                            _fmt2(format_bytes_to_mb(disk_io_sys.write_bytes)) if disk_io_sys else "0.00", # Disk Write MB (Cumulative)
+                            _fmt2(format_bytes_to_mb(net_io_sys.bytes_sent)) if net_io_sys else "0.00", # Net Sent MB (Cumulative)
+                            _fmt2(format_bytes_to_mb(net_io_sys.bytes_recv)) if net_io_sys else "0.00", # Net Received MB (Cumulative)
+                        )
+
+                        # Hand the data row for the current snapshot to the background CSV writer (never block the loop)
+                        _queue_summary_row(summary_csv[1], system_summary_data, summary_csv[0], summary_rows_dropped)
+                    if summary_ndjson is not None:
+                        # Raw numbers (no text formatting); the NDJSON writer serializes the whole row at once
+                        system_summary_record = {
+                            "timestamp": timestamp_str,
+                            "cpu_percent": total_cpu_overall,
+                            "ram_percent": total_mem.percent,
+                            "swap_percent": total_swap.percent,
+                            "disk_read_count": disk_io_sys.read_count if disk_io_sys else 0,
+                            "disk_write_count": disk_io_sys.write_count if disk_io_sys else 0,
+                            "disk_read_mb": format_bytes_to_mb(disk_io_sys.read_bytes) if disk_io_sys else 0.0,
+                            "disk_write_mb": format_bytes_to_mb(disk_io_sys.write_bytes) if disk_io_sys else 0.0,
+                            "net_sent_mb": format_bytes_to_mb(net_io_sys.bytes_sent) if net_io_sys else 0.0,
+                            "net_recv_mb": format_bytes_to_mb(net_io_sys.bytes_recv) if net_io_sys else 0.0,
+                        }
+                        _queue_summary_row(summary_ndjson[1], system_summary_record, summary_ndjson[0], summary_rows_dropped)
+                    logging.debug("Sys summary: CPU=%.2f%%, RAM=%.2f%%, SWAP=%.2f%%", total_cpu_overall, total_mem.percent, total_swap.percent)
+                except Exception as e:
+                    logging.error(f"Error collecting system summary: {e}", exc_info=True)
+            # <<< End of conditional block for the system summary outputs
+
+
+            # --- 5. Sleep until the next interval is due ---
+            # Snapshots are scheduled on a fixed grid of absolute deadlines, so variations in processing time
+            # do not accumulate as drift from one snapshot to the next
+            next_deadline = (snapshot_start_time if next_deadline is None else next_deadline) + repeat_interval_seconds
+            snapshot_end_time = time.monotonic()
+            elapsed_time = snapshot_end_time - snapshot_start_time # Time taken for this snapshot processing
+            sleep_time = next_deadline - snapshot_end_time
+            if sleep_time < 0.5:
+                # Behind schedule (processing took longer than the interval): keep the minimum 0.5s pause
+                # and move the grid forward instead of firing catch-up snapshots back to back
+                sleep_time = 0.5
+                next_deadline = snapshot_end_time + sleep_time
+            logging.info("Snapshot processing took %.2fs. Sleeping for %.2fs...", elapsed_time, sleep_time)
+            time.sleep(sleep_time) # Pause execution
 
 
     except KeyboardInterrupt:
@@ -658,6 +923,18 @@ def monitor_like_task_manager(repeat_interval_seconds, target_app_name=None):
         logging.critical(f"Critical error in main loop: {e}", exc_info=True)
         print(f"Error: Critical error occurred. Check '{LOG_FILENAME}' for details.")
         # Note: We don't exit immediately here to allow the logger to finish writing
+    finally:
+        # Let the background writers write whatever is queued (and close their files) before the script exits
+        _stop_writer_thread(snapshot_queue, snapshot_writer_thread, "snapshot")
+        # The snapshot descriptor is closed (and forgotten, so the next run reopens the file) only once its
+        # writer has finished; a writer that is still stuck keeps using it, and a later run reuses it
+        if not snapshot_writer_thread.is_alive():
+            os.close(_snap_fd)
+            _snap_fd = None
+        for summary_writer in (summary_csv, summary_ndjson):
+            if summary_writer is not None:
+                description, row_queue, thread = summary_writer
+                _stop_writer_thread(row_queue, thread, description)
 
 
 # --- Script Execution Entry Point ---
@@ -740,6 +1017,8 @@ if __name__ == "__main__":
     # Print system summary file path only if enabled
     if ENABLE_SYSTEM_SUMMARY_CSV:
         print(f" - System Summary: {SYSTEM_SUMMARY_FILENAME}")
+    if ENABLE_SYSTEM_SUMMARY_NDJSON:
+        print(f" - System Summary (NDJSON): {SYSTEM_SUMMARY_FILENAME_NDJSON}")
     print(f" - Script Log: {LOG_FILENAME}")
     print("(CPU%: Percentage of ONE logical core. Disk: Read/Write MB/s rate for the interval. Network: N/A per process)")
     print("Press Ctrl+C to stop.")
@@ -747,7 +1026,8 @@ if __name__ == "__main__":
     # --- Initialize/Clear global states for the start of the monitoring ---
     # These need to be empty for the first snapshot to work correctly
     previous_io_counters.clear()
-    process_objects_cache.clear()
+    previous_cpu_times.clear()
+    previous_proc_counters.clear()
     current_snapshot_data.clear()
 
     # --- Start the main monitoring function ---